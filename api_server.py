@@ -0,0 +1,176 @@
+import argparse
+import datetime
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import numpy as np
+import covid_data
+from covid_data import earlier_start_date, start_date, end_date
+from choices import X_choices, Y_choices
+from correlations import correlation_series, coefficient_funcs
+from data_quality import repair_policies
+from metrics import resolve
+
+# Serves the same correlation series as the "Correlation over time" chart, e.g.
+#   /correlations?x=Temperature&y=Daily%20Cases&delay=14&coefficient=Pearson%20Correlation&start=2020-06-01&end=2021-06-01
+#   /correlations?x=Mask%20Mandate&y=Daily%20Cases&format=binary
+#   /choices
+# Responses carry an ETag tied to the loaded data snapshot, so unchanged responses come back as 304s.
+
+max_cached_responses = 256
+max_delay = 30
+running_servers = {}
+
+
+def parse_date(value):
+    return datetime.datetime.strptime(value, '%Y-%m-%d').date()
+
+
+def parse_query(query_string):
+    params = {k: v[-1] for k, v in parse_qs(query_string).items()}
+    if params.get('x') not in X_choices:
+        raise ValueError(f'x must be one of: {", ".join(X_choices)}')
+    if params.get('y') not in Y_choices:
+        raise ValueError(f'y must be one of: {", ".join(Y_choices)}')
+    coefficient = params.get('coefficient', 'Spearman Correlation')
+    if coefficient not in coefficient_funcs:
+        raise ValueError(f'coefficient must be one of: {", ".join(coefficient_funcs)}')
+    fmt = params.get('format', 'json')
+    if fmt not in ('json', 'binary'):
+        raise ValueError('format must be json or binary')
+    try:
+        delay = int(params.get('delay', 0))
+        start = parse_date(params['start']) if 'start' in params else start_date
+        end = parse_date(params['end']) if 'end' in params else end_date
+        sincedate = parse_date(params['sincedate']) if 'sincedate' in params else start_date
+    except ValueError:
+        raise ValueError('delay must be an integer and dates must look like YYYY-MM-DD')
+    if not 0 <= delay <= max_delay:
+        raise ValueError(f'delay must be between 0 and {max_delay}')
+    for date in (start, end, sincedate):
+        if not earlier_start_date <= date <= end_date:
+            raise ValueError(f'dates must be between {earlier_start_date} and {end_date}')
+    if end < start:
+        raise ValueError('end must not be before start')
+    return (params['x'], params['y'], coefficient, delay, start, end, sincedate, fmt)
+
+
+def compute_series(metrics, query):
+    x_key, y_key, coefficient, delay, start, end, sincedate, fmt = query
+    x = X_choices[x_key]
+    y = Y_choices[y_key]
+    dates = [start + datetime.timedelta(days=i) for i in range((end - start).days + 1)]
+    date_strs = [date.strftime('%Y-%m-%d') for date in dates]
+    delayed_date_strs = [(date + datetime.timedelta(days=-delay)).strftime('%Y-%m-%d') for date in dates]
+    y_arr = metrics.rows(resolve(y['expr'], {'sincedate': str(sincedate)}), date_strs)
+    x_arr = metrics.rows(x['expr'], delayed_date_strs if x['date'] == 'delayed' else date_strs)
+    return correlation_series(x_arr, y_arr, coefficient)
+
+
+def encode_series(metrics, query, correlations, p_values):
+    x_key, y_key, coefficient, delay, start, end, sincedate, fmt = query
+    if fmt == 'binary':
+        # Little-endian float32, all correlations followed by all p-values (NaN where there is no data)
+        return np.stack([correlations, p_values]).astype('<f4').tobytes(), 'application/octet-stream'
+    res = {
+        'version': metrics.version,
+        'x': x_key,
+        'y': y_key,
+        'coefficient': coefficient,
+        'delay': delay,
+        'start': str(start),
+        'end': str(end),
+        'correlations': [None if np.isnan(v) else round(float(v), 6) for v in correlations],
+        'p_values': [None if np.isnan(v) else float('%.6g' % v) for v in p_values],
+    }
+    return json.dumps(res, separators=(',', ':')).encode(), 'application/json'
+
+
+class CorrelationRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        metrics = self.server.metrics
+        if url.path == '/choices':
+            query = ('choices',)
+        elif url.path == '/correlations':
+            try:
+                query = parse_query(url.query)
+            except ValueError as e:
+                return self.send_body(400, json.dumps({'error': str(e)}).encode(), 'application/json')
+        else:
+            return self.send_body(404, json.dumps({'error': 'not found'}).encode(), 'application/json')
+
+        etag = '"{}-{}"'.format(metrics.version, hashlib.sha1(repr(query).encode()).hexdigest()[:12])
+        if_none_match = self.headers.get('If-None-Match', '')
+        if etag in if_none_match or if_none_match.strip() == '*':
+            return self.send_body(304, b'', None, etag)
+
+        cache_key = (metrics.version, query)
+        with self.server.lock:
+            cached = self.server.responses.get(cache_key)
+            if cached is not None:
+                self.server.responses.move_to_end(cache_key)
+        if cached is None:
+            if query == ('choices',):
+                cached = json.dumps({
+                    'version': metrics.version,
+                    'x': list(X_choices),
+                    'y': list(Y_choices),
+                    'coefficients': list(coefficient_funcs),
+                    'start': str(start_date),
+                    'end': str(end_date),
+                }, separators=(',', ':')).encode(), 'application/json'
+            else:
+                correlations, p_values = compute_series(metrics, query)
+                cached = encode_series(metrics, query, correlations, p_values)
+            with self.server.lock:
+                self.server.responses[cache_key] = cached
+                while len(self.server.responses) > max_cached_responses:
+                    self.server.responses.popitem(last=False)
+        body, content_type = cached
+        self.send_body(200, body, content_type, etag)
+
+    def send_body(self, status, body, content_type, etag=None):
+        self.send_response(status)
+        if content_type is not None:
+            self.send_header('Content-Type', content_type)
+        if etag is not None:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def make_server(port, metrics, host='127.0.0.1'):
+    server = ThreadingHTTPServer((host, port), CorrelationRequestHandler)
+    server.metrics = metrics
+    server.responses = OrderedDict()
+    server.lock = threading.Lock()
+    return server
+
+
+def start_in_background(port, metrics, host='127.0.0.1'):
+    # Used by the Streamlit app, which reruns its script on every interaction, so only start one server per port
+    if port not in running_servers:
+        server = make_server(port, metrics, host)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        running_servers[port] = server
+    running_servers[port].metrics = metrics
+    return running_servers[port]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Serve COVID correlation series as JSON or binary arrays.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8600)
+    parser.add_argument('--repair-policy', choices=list(repair_policies.values()), default='none', help='How to repair the reporting artifacts found by the data quality check')
+    args = parser.parse_args()
+
+    metrics, report = covid_data.build_metrics(covid_data.load_data(), args.repair_policy)
+    server = make_server(args.port, metrics, args.host)
+    print(f'Serving correlations on http://{args.host}:{args.port} (data version {metrics.version})')
+    server.serve_forever()
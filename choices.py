@@ -0,0 +1,139 @@
+X_choices = {
+    'Temperature': {
+        'title': 'Temperature',
+        'x_label': 'State Temperature (°F)',
+        'date': 'delayed',
+        'expr': ('var', 'temps'),
+        'caption': 'Positive correlation shows that more cases happen in hot states. Negative correlation shows that more cases happen in cold states. There seems to be an interesting pattern that there is a positive correlation during the summer (hotter states have more cases), and negative during the winter (colder states have more cases). Temperature information was taken from Visual Crossing Weather API (https://www.visualcrossing.com/weather-api). I used a 14-day rolling average for daily temperature.',
+    },
+    'Vaccinations Completed': {
+        'title': 'Vaccinations Completed',
+        'x_label': 'State Vaccines Completed',
+        'date': 'delayed',
+        'expr': ('var', 'vaccines'),
+        'caption': 'Vaccinations are based on how many people were fully-vaccinated at that point in time. We would expect to see a negative correlation as more vaccines are administered, which is what we do see.',
+    },
+    'Vaccinations Completed (% of Population)': {
+        'title': 'Vaccinations Completed (% of Population)',
+        'x_label': 'State Population Fully Vaccinated (%)',
+        'date': 'delayed',
+        'expr': ('per', ('var', 'vaccines'), 100),
+        'caption': 'Same as Vaccinations Completed, but shown as the percent of the state\'s population that was fully-vaccinated at that point in time.',
+    },
+    'Temperature Change (14 Days)': {
+        'title': 'Temperature Change (14 Days)',
+        'x_label': 'Change in State Temperature from 14 Days Before (°F)',
+        'date': 'delayed',
+        'expr': ('diff', ('var', 'temps'), 14),
+        'caption': 'Positive values mean the state has been warming up over the last two weeks, negative values mean it has been cooling down. Uses the same 14-day rolling average temperature as Temperature.',
+    },
+    'Vaccinations Completed (Numbers Reported Right Now)': {
+        'title': 'Vaccinations Completed (Numbers Reported Right Now)',
+        'x_label': 'State Vaccines Completed',
+        'date': 'none',
+        'expr': ('var', 'vaccines_today'),
+        'caption': 'Vaccinations are based on how many people are currently fully-vaccinated right now. This is to see if there are possible spurious correlations based on vaccinations. For example, you can see that right now, there is a strong negative correlation between vaccinations and cases, which is in support of vaccinating. However, the same correlation exists between TODAY\'S vaccination rate and SEPTEMBER OF LAST YEAR\'S cases, which is obviously a spurious correlation since today\'s vaccinations couldn\'t possible have had an effect on last year\'s case numbers. Vaccinations likely do have a large causal effect, but there is clearly another underlying cause leading to the correlation for last year.',
+    },
+    'Mask Mandate': {
+        'title': 'Mask Mandate',
+        'x_label': 'State Has Mask Mandate (1 if yes, 0 if no)',
+        'date': 'delayed',
+        'expr': ('var', 'maskmandate'),
+        'caption': 'Mask mandates do not seem to show a strong correlation with case numbers. Mask Mandate information was taken from Start Date and End Date found in this table: https://en.wikipedia.org/wiki/Face_masks_during_the_COVID-19_pandemic_in_the_United_States#Summary_of_orders_and_recommendations_issued_by_states. It is coarse and not very accurate.'
+    },
+    'Political Leaning': {
+        'title': 'State Political Leaning by Democratic Advantage',
+        'x_label': 'Democratic Advantage (%)',
+        'date': 'none',
+        'expr': ('var', 'politicals'),
+        'caption': 'Political Leaning information is based on how many percentage points that the Democratic party has over the Republican party, and was taken from a Gallup 2017 poll: https://news.gallup.com/poll/226643/2017-party-affiliation-state.aspx.'
+    },
+    'Median Age': {
+        'title': 'State Median Age',
+        'x_label': 'Median Age (years)',
+        'date': 'none',
+        'expr': ('var', 'ages'),
+        'caption': 'Age information taken from https://en.wikipedia.org/wiki/List_of_U.S._states_and_territories_by_median_age'
+    },
+    'Population Density': {
+        'title': 'State Population Density',
+        'x_label': 'Population Density (people/km^2)',
+        'date': 'none',
+        'expr': ('var', 'densities'),
+        'caption': 'The measure used here is "population-weighted population density," which takes into account urbanization. For example, New York state actually is not #1 in simple population density (since it is a fairly big state). However, most people living in New York are actually densely populated in NYC. Population-weighted population density takes this into account. Data and idea taken from https://wernerantweiler.ca/blog.php?item=2020-04-12&fbclid=IwAR2CHyOg5bFw3Rbu0c4-m8pc0D4cX2GVfCkzupUoCmUbL4NB1WQAaIZOx0s'
+    },
+    'Uninsured Rate': {
+        'title': 'State Uninsured Rate',
+        'x_label': 'Percent Uninsured (%)',
+        'date': 'none',
+        'expr': ('var', 'uninsureds'),
+        'caption': 'Percent uninsured information taken from https://www.kff.org/other/state-indicator/total-population/?currentTimeframe=0&sortModel=%7B%22colId%22:%22Location%22,%22sort%22:%22asc%22%7D'
+    },
+    'Median Household Income': {
+        'title': 'State Median Household Income',
+        'x_label': 'Median Household Income ($)',
+        'date': 'none',
+        'expr': ('var', 'household_incomes'),
+        'caption': 'Household income information taken from https://worldpopulationreview.com/state-rankings/median-household-income-by-state which took its data from the Census ACS survey https://www.census.gov/library/visualizations/interactive/2019-median-household-income.html'
+    },
+    'Healthcare Ranking': {
+        'title': 'State Healthcare Ranking',
+        'x_label': 'Healthcare Ranking',
+        'date': 'none',
+        'expr': ('var', 'healthcare_rankings'),
+        'caption': 'Healthcare rankings are {1-50} with lower numbers being better, e.g. Hawaii is #1 with the best healthcare quality and Alabama is #50 with the worst. Healthcare ranking information taken from https://www.usnews.com/news/best-states/rankings/health-care/healthcare-quality'
+    },
+}
+
+Y_choices = {
+    'Daily Cases': {
+        'title': 'Daily Cases',
+        'y_label': 'Daily Cases per 100k',
+        'expr': ('var', 'cases'),
+    },
+    'Daily Deaths': {
+        'title': 'Daily Deaths',
+        'y_label': 'Daily Deaths per 100k',
+        'expr': ('var', 'deaths'),
+    },
+    'Total Cases': {
+        'title': 'Total Cases',
+        'y_label': 'Total Cases per 100k',
+        'expr': ('var', 'totalcases'),
+    },
+    'Total Deaths': {
+        'title': 'Total Deaths',
+        'y_label': 'Total Deaths per 100k',
+        'expr': ('var', 'totaldeaths'),
+    },
+    'Total Vaccinations': {
+        'title': 'Total Vaccinations',
+        'y_label': 'Total Vaccinations per 100k',
+        'expr': ('var', 'vaccines'),
+    },
+    'Total Cases Since XX': {
+        'title': 'Total Cases Since XX',
+        'y_label': 'Total Cases per 100k',
+        'expr': ('since', ('var', 'totalcases'), ('param', 'sincedate')),
+    },
+    'Total Deaths Since XX': {
+        'title': 'Total Deaths Since XX',
+        'y_label': 'Total Deaths per 100k',
+        'expr': ('since', ('var', 'totaldeaths'), ('param', 'sincedate')),
+    },
+    'Case Fatality Rate': {
+        'title': 'Case Fatality Rate',
+        'y_label': 'Total Deaths per 100 Total Cases (%)',
+        'expr': ('scale', ('ratio', ('var', 'totaldeaths'), ('var', 'totalcases')), 100),
+    },
+    'Weekly Case Growth': {
+        'title': 'Weekly Case Growth',
+        'y_label': 'Change in Daily Cases from 7 Days Before (%)',
+        'expr': ('scale', ('growth', ('var', 'cases'), 7), 100),
+    },
+    'Log Daily Cases': {
+        'title': 'Log Daily Cases',
+        'y_label': 'log(1 + Daily Cases per 100k)',
+        'expr': ('log', ('var', 'cases')),
+    },
+}
@@ -0,0 +1,338 @@
+import warnings
+import numpy as np
+from scipy import stats
+from scipy.stats import rankdata
+
+
+def date_array(date2values, date_strs, num_states):
+    # Stack a date -> per-state list dict into a (dates x states) array.
+    # Dates that are missing or don't have one value per state become NaN rows.
+    arr = np.full((len(date_strs), num_states), np.nan)
+    for date_idx, date_str in enumerate(date_strs):
+        values = date2values.get(date_str, [])
+        if len(values) == num_states:
+            arr[date_idx] = values
+    return arr
+
+
+def window_sums(arr, window):
+    # Sum of every `window`-long run along the date axis, from a single cumulative sum.
+    cumsum = np.cumsum(arr, axis=0)
+    cumsum = np.vstack([np.zeros((1,) + arr.shape[1:]), cumsum])
+    return cumsum[window:] - cumsum[:-window]
+
+
+def rolling_correlation(x_arr, y_arr, window, min_periods=3):
+    # Pearson correlation between x and y inside each state (column) over a trailing window of dates.
+    # Any lag is applied by the caller when building x_arr (row t of x_arr is paired with row t of y_arr).
+    # Everything is computed from running sums, so all states x all dates take one linear pass.
+    window = min(window, len(x_arr))
+    valid = ~(np.isnan(x_arr) | np.isnan(y_arr))
+    num_valid = np.maximum(valid.sum(axis=0), 1)
+    x = np.where(valid, x_arr, 0)
+    y = np.where(valid, y_arr, 0)
+    # Center each state first so the running sums of squares don't lose precision
+    x = np.where(valid, x - x.sum(axis=0) / num_valid, 0)
+    y = np.where(valid, y - y.sum(axis=0) / num_valid, 0)
+
+    count = window_sums(valid.astype(float), window)
+    sum_x = window_sums(x, window)
+    sum_y = window_sums(y, window)
+    sum_xx = window_sums(x * x, window)
+    sum_yy = window_sums(y * y, window)
+    sum_xy = window_sums(x * y, window)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sum_xy - sum_x * sum_y / count
+        var_x = sum_xx - sum_x * sum_x / count
+        var_y = sum_yy - sum_y * sum_y / count
+        corr = cov / np.sqrt(var_x * var_y)
+    # Windows where either side is (numerically) constant have no defined correlation
+    flat = (var_x <= 1e-10 * sum_xx) | (var_y <= 1e-10 * sum_yy)
+    corr[(count < min_periods) | flat] = np.nan
+    corr = np.clip(corr, -1, 1)
+
+    res = np.full(x_arr.shape, np.nan)
+    res[window - 1:] = corr
+    return res
+
+
+def pearson_series(x_arr, y_arr):
+    # Pearson correlation across states (columns) for every date (row) at once
+    num_states = x_arr.shape[1]
+    x = x_arr - x_arr.mean(axis=1, keepdims=True)
+    y = y_arr - y_arr.mean(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corrs = np.clip((x * y).sum(axis=1) / np.sqrt((x * x).sum(axis=1) * (y * y).sum(axis=1)), -1, 1)
+    return corrs, t_test_p_values(corrs, num_states)
+
+
+def spearman_series(x_arr, y_arr):
+    x_ranks = rankdata(x_arr, axis=1)
+    y_ranks = rankdata(y_arr, axis=1)
+    return pearson_series(x_ranks, y_ranks)
+
+
+def t_test_p_values(corrs, num_states):
+    # Two-sided p-values for correlations of `num_states` pairs, same as scipy's pearsonr and spearmanr
+    dof = num_states - 2
+    if dof < 1:
+        return np.full(corrs.shape, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = corrs * np.sqrt(dof / (1 - corrs * corrs))
+    return 2 * stats.t.sf(np.abs(t), dof)
+
+
+def tie_group_sizes(*sorted_arrs):
+    # Sizes of the runs of equal values in each row of already-sorted arrays, padded with zeros
+    rows, num_states = sorted_arrs[0].shape
+    is_start = np.ones((rows, num_states), dtype=bool)
+    is_start[:, 1:] = np.any([arr[:, 1:] != arr[:, :-1] for arr in sorted_arrs], axis=0)
+    group_ids = np.cumsum(is_start, axis=1) - 1 + np.arange(rows)[:, None] * num_states
+    return np.bincount(group_ids.ravel(), minlength=rows * num_states).reshape(rows, num_states)
+
+
+def kendall_series(x_arr, y_arr):
+    # Kendall's tau-b with Knight's O(n log n) algorithm, run on every date at once: sort each row by
+    # (x, y), then count the pairs that are out of order in y with a Fenwick tree over the y ranks.
+    rows, num_states = x_arr.shape
+    corrs = np.full(rows, np.nan)
+    p_values = np.full(rows, np.nan)
+    is_valid = ~(np.isnan(x_arr).any(axis=1) | np.isnan(y_arr).any(axis=1))
+    if num_states < 2 or not is_valid.any():
+        return corrs, p_values
+    x_arr = x_arr[is_valid]
+    y_arr = y_arr[is_valid]
+    rows = len(x_arr)
+
+    order = np.lexsort((y_arr, x_arr), axis=1)
+    x = np.take_along_axis(x_arr, order, axis=1)
+    y = np.take_along_axis(y_arr, order, axis=1)
+    y_ranks = rankdata(y, method='dense', axis=1).astype(int)
+
+    row_idx = np.arange(rows)
+    tree = np.zeros((rows, num_states + 2))
+    discordant = np.zeros(rows)
+    num_steps = int(num_states).bit_length() + 1
+    for j in range(num_states):
+        # Number of earlier values with a y rank <= this one (tree[:, 0] is always 0)
+        idx = y_ranks[:, j].copy()
+        num_below = np.zeros(rows)
+        for _ in range(num_steps):
+            num_below += tree[row_idx, idx]
+            idx -= idx & -idx
+        discordant += j - num_below
+        # Add this rank, the last column just soaks up updates that run past the end
+        idx = y_ranks[:, j].copy()
+        for _ in range(num_steps):
+            tree[row_idx, np.minimum(idx, num_states + 1)] += 1
+            idx += idx & -idx
+
+    x_ties = tie_group_sizes(x)
+    y_ties = tie_group_sizes(np.sort(y_arr, axis=1))
+    joint_ties = tie_group_sizes(x, y)
+    x_tied_pairs = (x_ties * (x_ties - 1) // 2).sum(axis=1)
+    y_tied_pairs = (y_ties * (y_ties - 1) // 2).sum(axis=1)
+    joint_tied_pairs = (joint_ties * (joint_ties - 1) // 2).sum(axis=1)
+    total_pairs = num_states * (num_states - 1) // 2
+    con_minus_dis = total_pairs - x_tied_pairs - y_tied_pairs + joint_tied_pairs - 2 * discordant
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tau = con_minus_dis / np.sqrt((total_pairs - x_tied_pairs) * (total_pairs - y_tied_pairs))
+
+        # Normal approximation with tie correction, same as scipy's kendalltau(method='asymptotic')
+        m = num_states * (num_states - 1.)
+        x_ties = x_ties.astype(float)
+        y_ties = y_ties.astype(float)
+        var = ((m * (2 * num_states + 5) - (x_ties * (x_ties - 1) * (2 * x_ties + 5)).sum(axis=1)
+                - (y_ties * (y_ties - 1) * (2 * y_ties + 5)).sum(axis=1)) / 18
+               + 2 * x_tied_pairs * y_tied_pairs / m)
+        if num_states > 2:
+            var += ((x_ties * (x_ties - 1) * (x_ties - 2)).sum(axis=1) * (y_ties * (y_ties - 1) * (y_ties - 2)).sum(axis=1)
+                    / (9 * m * (num_states - 2)))
+        p = 2 * stats.norm.sf(np.abs(con_minus_dis / np.sqrt(var)))
+    corrs[is_valid] = np.clip(tau, -1, 1)
+    p_values[is_valid] = np.where(np.isnan(tau), np.nan, p)
+    return corrs, p_values
+
+
+def distance_correlation_series(x_arr, y_arr, max_chunk_size=2**20):
+    # Distance correlation from all pairwise distances, batched over as many dates as fit in max_chunk_size.
+    # It is 0 only when x and y are independent and picks up non-linear relationships, but is never negative.
+    rows, num_states = x_arr.shape
+    corrs = np.full(rows, np.nan)
+    p_values = np.full(rows, np.nan)
+    chunk = max(1, max_chunk_size // max(num_states * num_states, 1))
+    for start in range(0, rows, chunk):
+        x = x_arr[start:start + chunk]
+        y = y_arr[start:start + chunk]
+        a = np.abs(x[:, :, None] - x[:, None, :])
+        b = np.abs(y[:, :, None] - y[:, None, :])
+        # Means of the double-centered distance products, without building the centered matrices:
+        # mean(A * B) = mean(a * b) - 2 * mean(row_mean(a) * row_mean(b)) + mean(a) * mean(b)
+        a_row_means = a.mean(axis=2)
+        b_row_means = b.mean(axis=2)
+        a_mean = a_row_means.mean(axis=1)
+        b_mean = b_row_means.mean(axis=1)
+        num_pairs = num_states * num_states
+        dcov = np.einsum('rij,rij->r', a, b) / num_pairs - 2 * (a_row_means * b_row_means).mean(axis=1) + a_mean * b_mean
+        dvar_x = np.einsum('rij,rij->r', a, a) / num_pairs - 2 * (a_row_means * a_row_means).mean(axis=1) + a_mean * a_mean
+        dvar_y = np.einsum('rij,rij->r', b, b) / num_pairs - 2 * (b_row_means * b_row_means).mean(axis=1) + b_mean * b_mean
+        dcov = np.maximum(dcov, 0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corrs[start:start + chunk] = np.minimum(np.sqrt(dcov / np.sqrt(dvar_x * dvar_y)), 1)
+            # Conservative chi-squared test from Szekely et al. (2007), Theorem 6
+            p_values[start:start + chunk] = stats.chi2.sf(num_states * dcov / (a_mean * b_mean), 1)
+    return corrs, p_values
+
+
+def mutual_information_series(x_arr, y_arr):
+    # Mutual information from a joint histogram of equal-frequency (rank) bins, for every date at once.
+    # Reported as the informational coefficient of correlation sqrt(1 - exp(-2 MI)), which is on a
+    # 0 to 1 scale like the other coefficients; the p-value is from the G-test of independence.
+    rows, num_states = x_arr.shape
+    corrs = np.full(rows, np.nan)
+    p_values = np.full(rows, np.nan)
+    is_valid = ~(np.isnan(x_arr).any(axis=1) | np.isnan(y_arr).any(axis=1))
+    if num_states < 2 or not is_valid.any():
+        return corrs, p_values
+    rows = is_valid.sum()
+    num_bins = max(2, int(round(np.sqrt(num_states / 5))))
+    x_bins = np.minimum(((rankdata(x_arr[is_valid], axis=1) - 1) * num_bins / num_states).astype(int), num_bins - 1)
+    y_bins = np.minimum(((rankdata(y_arr[is_valid], axis=1) - 1) * num_bins / num_states).astype(int), num_bins - 1)
+    cell_ids = (np.arange(rows)[:, None] * num_bins + x_bins) * num_bins + y_bins
+    joint = np.bincount(cell_ids.ravel(), minlength=rows * num_bins * num_bins).reshape(rows, num_bins, num_bins) / num_states
+    independent = joint.sum(axis=2, keepdims=True) * joint.sum(axis=1, keepdims=True)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mi = np.where(joint > 0, joint * np.log(joint / independent), 0).sum(axis=(1, 2))
+    mi = np.maximum(mi, 0)
+    corrs[is_valid] = np.sqrt(1 - np.exp(-2 * mi))
+    p_values[is_valid] = stats.chi2.sf(2 * num_states * mi, (num_bins - 1) ** 2)
+    return corrs, p_values
+
+
+coefficient_funcs = {
+    'Spearman Correlation': spearman_series,
+    'Pearson Correlation': pearson_series,
+    'Kendall Tau': kendall_series,
+    'Distance Correlation': distance_correlation_series,
+    'Mutual Information': mutual_information_series,
+}
+
+
+def correlation_series(x_arr, y_arr, coefficient, min_states=3):
+    # Correlation and p-value between x and y across states for every date (row) in one batch.
+    # States missing either value on a date (e.g. a ratio with a zero denominator) are left out of that
+    # date only, and dates with fewer than min_states states left come out as NaN.
+    x_arr = np.asarray(x_arr, dtype=float)
+    y_arr = np.asarray(y_arr, dtype=float)
+    if len(x_arr) == 0:
+        return np.zeros(0), np.zeros(0)
+    func = coefficient_funcs[coefficient]
+    is_valid = ~(np.isnan(x_arr) | np.isnan(y_arr))
+    is_complete = is_valid.all(axis=1)
+    if is_complete.all():
+        return func(x_arr, y_arr)
+    corrs = np.full(len(x_arr), np.nan)
+    p_values = np.full(len(x_arr), np.nan)
+    if is_complete.any():
+        corrs[is_complete], p_values[is_complete] = func(x_arr[is_complete], y_arr[is_complete])
+    partial_rows = np.nonzero(~is_complete & (is_valid.sum(axis=1) >= min_states))[0]
+    if len(partial_rows) > 0:
+        # Dates that are missing the same states are still computed in one batch
+        masks, groups = np.unique(is_valid[partial_rows], axis=0, return_inverse=True)
+        for group, keep in enumerate(masks):
+            rows = partial_rows[groups.ravel() == group]
+            corrs[rows], p_values[rows] = func(x_arr[rows][:, keep], y_arr[rows][:, keep])
+    return corrs, p_values
+
+
+def pearson_leave_one_out(x_arr, y_arr, min_states=3):
+    # Pearson correlation for every date with each state left out in turn, as a (dates x states) array.
+    # Removing one state just subtracts its terms from the row sums, so there are no refits.
+    # States missing x or y on a date add nothing to that date's sums, like in correlation_series.
+    valid = ~(np.isnan(x_arr) | np.isnan(y_arr))
+    num_valid = valid.sum(axis=1, keepdims=True)
+    x = np.where(valid, x_arr, 0)
+    y = np.where(valid, y_arr, 0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = np.where(valid, x - x.sum(axis=1, keepdims=True) / num_valid, 0)
+        y = np.where(valid, y - y.sum(axis=1, keepdims=True) / num_valid, 0)
+    n = num_valid - valid
+    sum_x = x.sum(axis=1, keepdims=True) - x
+    sum_y = y.sum(axis=1, keepdims=True) - y
+    sum_xx = (x * x).sum(axis=1, keepdims=True) - x * x
+    sum_yy = (y * y).sum(axis=1, keepdims=True) - y * y
+    sum_xy = (x * y).sum(axis=1, keepdims=True) - x * y
+    with np.errstate(divide='ignore', invalid='ignore'):
+        cov = sum_xy - sum_x * sum_y / n
+        var_x = sum_xx - sum_x * sum_x / n
+        var_y = sum_yy - sum_y * sum_y / n
+        corrs = cov / np.sqrt(var_x * var_y)
+    corrs[(var_x <= 1e-10 * sum_xx) | (var_y <= 1e-10 * sum_yy) | (n < min_states)] = np.nan
+    return np.clip(corrs, -1, 1)
+
+
+def leave_one_out_series(x_arr, y_arr, coefficient):
+    # Jackknife of correlation_series: column i of the result is the coefficient with state i left out
+    x_arr = np.asarray(x_arr, dtype=float)
+    y_arr = np.asarray(y_arr, dtype=float)
+    if coefficient == 'Pearson Correlation':
+        return pearson_leave_one_out(x_arr, y_arr)
+    num_states = x_arr.shape[1]
+    res = np.full(x_arr.shape, np.nan)
+    for state_idx in range(num_states):
+        keep = np.arange(num_states) != state_idx
+        res[:, state_idx] = correlation_series(x_arr[:, keep], y_arr[:, keep], coefficient)[0]
+    return res
+
+
+def build_rank_index(arr):
+    # Per-date means, standard deviations and standardized values/ranks of one metric, so a single-date
+    # Pearson or Spearman correlation against any other indexed metric is just one dot product.
+    # Missing states are left out of the statistics and stay NaN.
+    with np.errstate(divide='ignore', invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        mean = np.nanmean(arr, axis=1)
+        std = np.nanstd(arr, axis=1)
+        ranks = rankdata(arr, axis=1, nan_policy='omit')
+        rank_std = np.nanstd(ranks, axis=1)
+        return {
+            'values': arr,
+            'is_complete': ~np.isnan(arr).any(axis=1),
+            'mean': mean,
+            'std': std,
+            'z': (arr - mean[:, None]) / np.where(std > 0, std, np.nan)[:, None],
+            'rank_z': (ranks - np.nanmean(ranks, axis=1, keepdims=True)) / np.where(rank_std > 0, rank_std, np.nan)[:, None],
+        }
+
+
+indexed_coefficients = {
+    'Pearson Correlation': 'z',
+    'Spearman Correlation': 'rank_z',
+}
+
+
+def indexed_correlation(x_index, x_row, y_index, y_row, coefficient):
+    # Correlation, p-value and least-squares best-fit line (slope, intercept) for one date from two rank indexes
+    if not (x_index['is_complete'][x_row] and y_index['is_complete'][y_row]):
+        # The standardized values only line up when both metrics have every state, otherwise
+        # fall back to fitting the states that have both values on this date
+        x = x_index['values'][x_row]
+        y = y_index['values'][y_row]
+        keep = ~(np.isnan(x) | np.isnan(y))
+        if keep.sum() < 3:
+            return np.nan, np.nan, np.nan, np.nan
+        corrs, p_values = correlation_series(x[None, keep], y[None, keep], coefficient)
+        if len(np.unique(x[keep])) < 2:
+            return corrs[0], p_values[0], np.nan, np.nan
+        slope, intercept = np.polyfit(x[keep], y[keep], 1)
+        return corrs[0], p_values[0], slope, intercept
+    x_z = x_index['z'][x_row]
+    y_z = y_index['z'][y_row]
+    pearson = np.clip(np.mean(x_z * y_z), -1, 1)
+    slope = pearson * y_index['std'][y_row] / x_index['std'][x_row]
+    intercept = y_index['mean'][y_row] - slope * x_index['mean'][x_row]
+    key = indexed_coefficients[coefficient]
+    corr = np.clip(np.mean(x_index[key][x_row] * y_index[key][y_row]), -1, 1)
+    p = t_test_p_values(np.array([corr]), len(x_z))[0]
+    return corr, p, slope, intercept
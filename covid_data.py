@@ -0,0 +1,332 @@
+import os
+import requests
+import json
+from tqdm import tqdm
+import numpy as np
+from collections import defaultdict
+from dotenv import load_dotenv
+import datetime
+import dateutil.parser
+import csv
+from metrics import MetricEngine, build_base_arrays, has_params
+from choices import X_choices, Y_choices
+from data_quality import check_data, repair_data, quality_report, write_report
+
+us_state_to_abbrev = {
+    "Alabama": "AL",
+    "Alaska": "AK",
+    "Arizona": "AZ",
+    "Arkansas": "AR",
+    "California": "CA",
+    "Colorado": "CO",
+    "Connecticut": "CT",
+    "Delaware": "DE",
+    "Florida": "FL",
+    "Georgia": "GA",
+    "Hawaii": "HI",
+    "Idaho": "ID",
+    "Illinois": "IL",
+    "Indiana": "IN",
+    "Iowa": "IA",
+    "Kansas": "KS",
+    "Kentucky": "KY",
+    "Louisiana": "LA",
+    "Maine": "ME",
+    "Maryland": "MD",
+    "Massachusetts": "MA",
+    "Michigan": "MI",
+    "Minnesota": "MN",
+    "Mississippi": "MS",
+    "Missouri": "MO",
+    "Montana": "MT",
+    "Nebraska": "NE",
+    "Nevada": "NV",
+    "New Hampshire": "NH",
+    "New Jersey": "NJ",
+    "New Mexico": "NM",
+    "New York": "NY",
+    "North Carolina": "NC",
+    "North Dakota": "ND",
+    "Ohio": "OH",
+    "Oklahoma": "OK",
+    "Oregon": "OR",
+    "Pennsylvania": "PA",
+    "Rhode Island": "RI",
+    "South Carolina": "SC",
+    "South Dakota": "SD",
+    "Tennessee": "TN",
+    "Texas": "TX",
+    "Utah": "UT",
+    "Vermont": "VT",
+    "Virginia": "VA",
+    "Washington": "WA",
+    "West Virginia": "WV",
+    "Wisconsin": "WI",
+    "Wyoming": "WY",
+}
+states = list(sorted(us_state_to_abbrev.values()))
+abbrev_to_us_state = {v: k for k, v in us_state_to_abbrev.items()}
+
+earlier_start_date = datetime.date(2020, 3, 1)
+start_date = datetime.date(2020, 4, 1)
+end_date = datetime.date.today() - datetime.timedelta(days=3)
+end_date_temp = datetime.date(2021, 9, 20)
+start_date_str = start_date.strftime('%Y-%m-%d')
+end_date_str = end_date.strftime('%Y-%m-%d')
+
+def get_row_value(daterow, row, population, daterow_idx, field):
+    today_cases = daterow[field]
+    if today_cases is None:
+        cases = 0
+    else:
+        today_cases = today_cases / population * 100000
+        lastweek_cases = row['actualsTimeseries'][daterow_idx-7][field]
+        if lastweek_cases is None:
+            lastweek_cases = 0
+        else:
+            lastweek_cases = lastweek_cases / population * 100000
+        cases = (today_cases - lastweek_cases) * 7  # TODO: multiply by 7 but then need to fix all the annotation coords
+    return cases, today_cases or 0
+
+def load_data():
+
+    load_dotenv()
+
+    covidactnow_api_key = os.environ.get('COVID_ACTNOW_API_KEY')
+    # VisualCrossingWebServices_api_key = os.environ.get('VisualCrossingWebServices_API_KEY')
+    result = requests.get(f'https://api.covidactnow.org/v2/states.timeseries.json?apiKey={covidactnow_api_key}')
+    data = result.json()
+    a=0
+
+    with open('data/covid_data.json', 'w') as f:
+        json.dump(data, f, indent=2)
+
+    vaccines_today = []
+    temps = []
+    date2temps = defaultdict(list)
+    date2cases = defaultdict(list)
+    date2deaths = defaultdict(list)
+    date2totalcases = defaultdict(list)
+    date2totaldeaths = defaultdict(list)
+    date2vaccines = defaultdict(list)
+    dates = [start_date + datetime.timedelta(days=x) for x in range((end_date-start_date).days + 1)]
+    ealier_dates = [earlier_start_date + datetime.timedelta(days=x) for x in range((end_date-earlier_start_date).days + 1)]
+    for row in data:
+        state = row['state']
+        if state not in us_state_to_abbrev.values():
+            continue
+        population = row['population']
+        prev_vaccines = 0
+        vaccinationsCompleted = row['actuals']['vaccinationsCompleted']
+        maxvaccinationsCompleted = 0
+        for daterow_idx, daterow in enumerate(row['actualsTimeseries']):
+            if daterow_idx >= 7:
+                date = daterow['date']
+                # if state == 'WY' and date == '2021-06-29':
+                #     import pdb;pdb.set_trace()
+                cases, totalcases = get_row_value(daterow, row, population, daterow_idx, 'cases')
+                date2cases[date].append(cases)
+                date2totalcases[date].append(totalcases)
+                deaths, totaldeaths = get_row_value(daterow, row, population, daterow_idx, 'deaths')
+                date2deaths[date].append(deaths)
+                date2totaldeaths[date].append(totaldeaths)
+                if 'vaccinationsCompleted' in daterow and daterow['vaccinationsCompleted'] is not None:
+                    vaccines = int(daterow['vaccinationsCompleted'])
+                    maxvaccinationsCompleted = max(maxvaccinationsCompleted, vaccines)
+                    vaccines = vaccines / population * 100000
+                else:
+                    vaccines = prev_vaccines
+                prev_vaccines = vaccines
+                date2vaccines[date].append(vaccines)
+        if vaccinationsCompleted is None:
+            vaccinationsCompleted = maxvaccinationsCompleted
+        vaccines_today.append(vaccinationsCompleted / population * 100000)
+
+
+    for state_idx, state in enumerate(tqdm(states)):
+        with open(os.path.join('data', 'temp', state + '.json')) as f:
+            temp_data = json.load(f)
+        past_7_days = []
+        for row in temp_data:
+            date = row['Date time'].replace('/', '-')
+            date = datetime.datetime.strptime(date, '%m-%d-%Y').date().strftime('%Y-%m-%d')
+            temp = float(row['Temperature'])
+            if len(past_7_days) >= 14:
+                past_7_days = past_7_days[1:]
+            past_7_days.append(temp)
+            ave_temp = np.mean(past_7_days)
+            date2temps[date].append(ave_temp)
+
+    with open('data/mask_mandate.tsv') as f:
+        lines = f.read().splitlines()
+    state2startmaskmandate = {}
+    state2endmaskmandate = {}
+    cur_state = None
+    for line in lines:
+        if '\t' in line:
+            items = line.strip().split('\t')
+            cur_state = items[0]
+            start = items[1]
+            end = items[2]
+            if start == 'N/A':
+                start = datetime.date(1970, 1, 1)
+            else:
+                start = dateutil.parser.parse(start).date()
+            if end == 'N/A':
+                end = datetime.date(1970, 1, 1)
+            elif end == 'Ongoing':
+                end = datetime.date.today()
+            else:
+                end = dateutil.parser.parse(end).date()
+            state2startmaskmandate[cur_state] = start
+            state2endmaskmandate[cur_state] = end
+    date2maskmandate = defaultdict(list)
+    for state, start in state2startmaskmandate.items():
+        end = state2endmaskmandate[state]
+        for date in ealier_dates:
+            if date >= start and date <= end:
+                date2maskmandate[date.strftime('%Y-%m-%d')].append(1)
+            else:
+                date2maskmandate[date.strftime('%Y-%m-%d')].append(0)
+
+    with open('data/political_party.tsv') as f:
+        lines = f.read().splitlines()
+    political_tuples = []
+    for line in lines:
+        items = line.strip().split('\t')
+        state = us_state_to_abbrev[items[0]]
+        dem_leaning = int(items[3])
+        political_tuples.append((state, dem_leaning))
+    politicals = []
+    for state, dem_leaning in sorted(political_tuples):
+        politicals.append(dem_leaning)
+
+    with open('data/age.tsv') as f:
+        lines = f.read().splitlines()
+    age_tuples = []
+    for line in lines:
+        items = line.strip().split('\t')
+        if items[1].strip() not in us_state_to_abbrev:
+            continue
+        state = us_state_to_abbrev[items[1].strip()]
+        age = float(items[2])
+        age_tuples.append((state, age))
+    ages = []
+    for state, age in sorted(age_tuples):
+        ages.append(age)
+
+    with open('data/population_density.tsv') as f:
+        lines = f.read().splitlines()
+    density_tuples = []
+    for line in lines:
+        items = line.strip().split('\t')
+        if items[1].strip() not in states:
+            continue
+        state = items[1].strip()
+        density = float(items[5].strip())
+        density_tuples.append((state, density))
+    densities = []
+    for state, density in sorted(density_tuples):
+        densities.append(density)
+
+    with open("data/uninsured.csv") as f:
+        reader = csv.reader(f, delimiter=",", quotechar='"')
+        next(reader, None)  # skip the headers
+        data = [row for row in reader]
+    uninsured_tuples = []
+    for row in data:
+        if row[0] not in us_state_to_abbrev:
+            continue
+        state = us_state_to_abbrev[row[0]]
+        uninsured = float(row[6]) * 100
+        uninsured_tuples.append((state, uninsured))
+    uninsureds = []
+    for state, uninsured in sorted(uninsured_tuples):
+        uninsureds.append(uninsured)
+
+    with open("data/household_income.json") as f:
+        data = json.load(f)
+    data = {item['State']: item['HouseholdIncome'] for item in data}
+    household_incomes = []
+    for state in states:
+        full_state_name = abbrev_to_us_state[state]
+        household_income = data[full_state_name]
+        household_incomes.append(household_income)
+
+    with open('data/healthcare_ranking.tsv') as f:
+        lines = f.read().splitlines()
+    healthcare_ranking_tuples = []
+    cur_rank = 1
+    for line in lines:
+        if line.strip() not in us_state_to_abbrev:
+            continue
+        state = us_state_to_abbrev[line.strip()]
+        healthcare_ranking = cur_rank
+        healthcare_ranking_tuples.append((state, healthcare_ranking))
+        cur_rank += 1
+    healthcare_rankings = []
+    for state, healthcare_ranking in sorted(healthcare_ranking_tuples):
+        healthcare_rankings.append(healthcare_ranking)
+
+
+    return dates, ealier_dates, date2temps, date2cases, date2deaths, date2totalcases, date2totaldeaths, date2maskmandate, date2vaccines, vaccines_today, politicals, ages, densities, uninsureds, household_incomes, healthcare_rankings, states
+
+    # temp_filename = 'temps_{}.pkl'.format(temp_date)
+    # if os.path.exists(temp_filename):
+    # with open(temp_filename, 'rb') as f:
+    #     temps = pickle.load(f)
+    # else:
+
+    # files = os.listdir(os.path.join('data', 'temp'))
+    # for file in files:
+    #     os.rename(os.path.join('data', 'temp', file), os.path.join('data', 'temp', file.split('_')[0] + '.json'))
+    #
+    # start_temp_date = '2020-03-01'
+    # end_temp_date = '2021-09-20'
+    # # states = ['FL']
+    # for state in tqdm(states):
+    #
+    #     # result = requests.get(f'https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/weatherdata/history?&aggregateHours=24&startDateTime={temp_date}T00:00:00&endDateTime={temp_date}T00:00:00&unitGroup=us&contentType=csv&dayStartTime=0:0:00&dayEndTime=0:0:00&location={state},US&key={VisualCrossingWebServices_api_key}')
+    #
+    #     result = requests.get(f'https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/weatherdata/history?&aggregateHours=24&startDateTime={start_temp_date}T00:00:00&endDateTime={end_temp_date}T00:00:00&unitGroup=us&contentType=csv&dayStartTime=0:0:00&dayEndTime=0:0:00&location={state},US&key={VisualCrossingWebServices_api_key}')
+    #     reader = csv.reader(result.text.strip().splitlines(), delimiter=",", quotechar='"')
+    #     header = next(reader, None)
+    #     rows = []
+    #     for line in reader:
+    #         row = {header[item_idx]: item for item_idx, item in enumerate(line)}
+    #         rows.append(row)
+    #     temp_filename = os.path.join('data', 'temp', '{}_{}_{}.json'.format(state, start_temp_date, end_temp_date))
+    #     with open(temp_filename, 'w') as f:
+    #         json.dump(rows, f, indent=2)
+
+def build_metrics(data, repair_policy='none'):
+    dates, ealier_dates, date2temps, date2cases, date2deaths, date2totalcases, date2totaldeaths, date2maskmandate, date2vaccines, vaccines_today, politicals, ages, densities, uninsureds, household_incomes, healthcare_rankings, states = data
+    date_vars = {
+        'temps': date2temps,
+        'cases': date2cases,
+        'deaths': date2deaths,
+        'totalcases': date2totalcases,
+        'totaldeaths': date2totaldeaths,
+        'maskmandate': date2maskmandate,
+        'vaccines': date2vaccines,
+    }
+    state_vars = {
+        'vaccines_today': vaccines_today,
+        'politicals': politicals,
+        'ages': ages,
+        'densities': densities,
+        'uninsureds': uninsureds,
+        'household_incomes': household_incomes,
+        'healthcare_rankings': healthcare_rankings,
+    }
+    date_strs = [date.strftime('%Y-%m-%d') for date in ealier_dates]
+    base = build_base_arrays(date_strs, date_vars, state_vars, len(states))
+    flags = check_data(base)
+    report = quality_report(flags, date_vars, date_strs, states, repair_policy)
+    write_report(report)
+    metrics = MetricEngine(repair_data(base, flags, repair_policy), date_strs)
+    # Build the per-date rank index up front so moving the date slider only reads from it
+    for choice in list(X_choices.values()) + list(Y_choices.values()):
+        if not has_params(choice['expr']):
+            metrics.index(choice['expr'])
+    return metrics, report
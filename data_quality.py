@@ -0,0 +1,151 @@
+import json
+import warnings
+import numpy as np
+from metrics import shift
+
+# Checks the loaded (dates x states) arrays for reporting artifacts before anything is correlated:
+#   negative     daily/weekly values below 0, or cumulative totals below their earlier peak (backfills and corrections)
+#   spike        values far above the state's rolling median (data dumps)
+#   zero_dropout cumulative totals that fall back to 0 because the API returned None for that day
+#   stale        vaccinations carried forward unchanged for a long time (the loader forward-fills missing days)
+# plus dates where a metric doesn't have one value per state, which can't be lined up with the states at all.
+
+repair_policies = {
+    'Flag only': 'none',
+    'Clip negatives': 'clip',
+    'Interpolate flagged values': 'interpolate',
+}
+
+flow_metrics = {'cases': 'totalcases', 'deaths': 'totaldeaths'}
+cumulative_metrics = ['totalcases', 'totaldeaths', 'vaccines']
+forward_filled_metrics = ['vaccines']
+
+
+def rolling_median(arr, window):
+    half = window // 2
+    padded = np.pad(arr, ((half, half), (0, 0)), mode='edge')
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window, axis=0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanmedian(windows, axis=-1)
+
+
+def run_lengths(arr):
+    # Length of the run of identical values that each cell belongs to, along the date axis
+    num_dates = len(arr)
+    same = np.zeros(arr.shape, dtype=bool)
+    same[1:] = arr[1:] == arr[:-1]
+    date_idx = np.arange(num_dates)[:, None]
+    run_start = np.maximum.accumulate(np.where(same, 0, date_idx), axis=0)
+    continues = np.zeros(arr.shape, dtype=bool)
+    continues[:-1] = same[1:]
+    run_end = np.minimum.accumulate(np.where(continues, num_dates, date_idx)[::-1], axis=0)[::-1]
+    return run_end - run_start + 1, run_start == date_idx
+
+
+def check_data(base, spike_factor=5, spike_window=15, min_spike=10, stale_days=14):
+    flags = {}
+    for name in cumulative_metrics:
+        arr = base[name]
+        prev_max = shift(np.fmax.accumulate(arr, axis=0), 1)
+        flags[name] = {
+            'negative': arr < prev_max,
+            'zero_dropout': (arr == 0) & (prev_max > 0),
+        }
+        if name in forward_filled_metrics:
+            run_len, is_run_start = run_lengths(arr)
+            flags[name]['stale'] = (run_len >= stale_days) & ~is_run_start & (arr > 0)
+    for name, total_name in flow_metrics.items():
+        arr = base[name]
+        median = rolling_median(arr, spike_window)
+        # Weekly values are today's total minus the total 7 days ago, so a dropout on either day breaks them
+        dropped = flags[total_name]['zero_dropout']
+        flags[name] = {
+            'negative': arr < 0,
+            'spike': (arr > spike_factor * np.maximum(median, 0)) & (arr > min_spike),
+            'zero_dropout': dropped | (shift(dropped.astype(float), 7) == 1),
+        }
+    return flags
+
+
+def interpolate_missing(arr):
+    # Linear interpolation along the date axis over NaN cells, leaving leading/trailing NaNs alone
+    num_dates = len(arr)
+    date_idx = np.broadcast_to(np.arange(num_dates)[:, None], arr.shape)
+    is_valid = ~np.isnan(arr)
+    prev_idx = np.maximum.accumulate(np.where(is_valid, date_idx, -1), axis=0)
+    next_idx = np.minimum.accumulate(np.where(is_valid, date_idx, num_dates)[::-1], axis=0)[::-1]
+    has_both = (prev_idx >= 0) & (next_idx < num_dates)
+    state_idx = np.broadcast_to(np.arange(arr.shape[1]), arr.shape)
+    prev_val = arr[np.clip(prev_idx, 0, num_dates - 1), state_idx]
+    next_val = arr[np.clip(next_idx, 0, num_dates - 1), state_idx]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        weight = np.where(next_idx > prev_idx, (date_idx - prev_idx) / (next_idx - prev_idx), 0)
+    res = arr.copy()
+    fill = ~is_valid & has_both
+    res[fill] = (prev_val + weight * (next_val - prev_val))[fill]
+    return res
+
+
+def interpolate_flagged(arr, issues):
+    is_flagged = np.any(list(issues.values()), axis=0)
+    res = interpolate_missing(np.where(is_flagged, np.nan, arr))
+    # Anything that couldn't be interpolated (at the start or end) keeps its original value
+    return np.where(np.isnan(res), arr, res)
+
+
+def repair_data(base, flags, policy):
+    if policy == 'none':
+        return base
+    base = dict(base)
+    for name in cumulative_metrics:
+        arr = base[name]
+        if policy == 'clip':
+            # Totals never go down, so carry the highest value so far forward
+            arr = np.where(np.isnan(arr), arr, np.fmax.accumulate(arr, axis=0))
+        elif policy == 'interpolate':
+            arr = interpolate_flagged(arr, flags[name])
+        base[name] = arr
+    for name, total_name in flow_metrics.items():
+        # Rebuild the weekly values from the repaired totals the same way get_row_value does,
+        # so they stay consistent; the first week has no total 7 days earlier and keeps the loaded values
+        total = base[total_name]
+        rebuilt = (total - shift(total, 7)) * 7
+        arr = np.where(np.isnan(rebuilt), base[name], rebuilt)
+        if policy == 'clip':
+            arr = np.where(arr < 0, 0, arr)
+        elif policy == 'interpolate':
+            # Dumps of old cases are still in the totals, and a correction that lasts to the last date can't be
+            # interpolated there, so fix spikes and any weekly values that still come out negative
+            arr = interpolate_flagged(arr, {'spike': flags[name]['spike'], 'negative': arr < 0})
+        base[name] = arr
+    return base
+
+
+def quality_report(flags, date_vars, date_strs, states, policy):
+    num_states = len(states)
+    report = {'repair_policy': policy, 'misaligned_dates': {}, 'issues': {}}
+    for name, date2values in date_vars.items():
+        misaligned = [date_str for date_str in date_strs if 0 < len(date2values.get(date_str, [])) != num_states]
+        if len(misaligned) > 0:
+            report['misaligned_dates'][name] = misaligned
+    for name, issues in flags.items():
+        report['issues'][name] = {}
+        for issue, is_flagged in issues.items():
+            date_idx, state_idx = np.nonzero(is_flagged)
+            state_counts = np.bincount(state_idx, minlength=num_states)
+            report['issues'][name][issue] = {
+                'count': int(len(date_idx)),
+                'states': {states[i]: int(state_counts[i]) for i in np.argsort(-state_counts) if state_counts[i] > 0},
+                'first_date': date_strs[date_idx.min()] if len(date_idx) > 0 else None,
+                'last_date': date_strs[date_idx.max()] if len(date_idx) > 0 else None,
+            }
+    return report
+
+
+def write_report(report, path=None):
+    # One file per repair policy, since the app and the API can each build the metrics with a different one
+    if path is None:
+        path = f"data/quality_report_{report['repair_policy']}.json"
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
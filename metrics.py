@@ -0,0 +1,161 @@
+import hashlib
+import threading
+from collections import OrderedDict
+import numpy as np
+from correlations import date_array, build_rank_index, indexed_correlation
+
+
+# Metrics are nested tuples such as ('since', ('var', 'totalcases'), ('param', 'sincedate')).
+# Each one is evaluated over the whole (dates x states) array at once and memoized, so the
+# same metric isn't recomputed for every date or every rerun of the app.
+#
+#   ('var', name)              a loaded base array, e.g. 'cases', 'temps', 'politicals'
+#   ('param', name)            filled in from the params passed to resolve()
+#   ('since', expr, date)      value minus its value on `date`
+#   ('diff', expr, days)       value minus its value `days` earlier
+#   ('growth', expr, days)     relative change from `days` earlier (0.1 = 10% growth)
+#   ('ratio', expr, expr)      first divided by second, e.g. deaths / cases
+#   ('per', expr, people)      rescale a per-100k value to per `people` people
+#   ('scale', expr, factor)    multiply by a constant
+#   ('log', expr)              log(1 + value), negatives clipped to 0
+#
+# Metrics that use an op filled in from params (every Since Date picked in the app or sent to the API
+# is a new metric) are only kept for the most recently used few, everything else is kept for good.
+
+max_param_cached = 16
+param_ops = {'since'}
+
+
+def has_params(expr):
+    if not isinstance(expr, tuple):
+        return False
+    return expr[0] == 'param' or any(has_params(arg) for arg in expr)
+
+
+def uses_param_ops(expr):
+    if not isinstance(expr, tuple):
+        return False
+    return expr[0] in param_ops or any(uses_param_ops(arg) for arg in expr)
+
+
+def resolve(expr, params):
+    if not isinstance(expr, tuple):
+        return expr
+    if expr[0] == 'param':
+        return params[expr[1]]
+    return tuple(resolve(arg, params) for arg in expr)
+
+
+def shift(arr, days):
+    res = np.full(arr.shape, np.nan)
+    if days < len(arr):
+        res[days:] = arr[:len(arr) - days]
+    return res
+
+
+def snapshot_version(base, date_strs):
+    # Short hash of the loaded data, changes whenever any of the base arrays or dates change
+    sha = hashlib.sha1()
+    sha.update('\n'.join(date_strs).encode())
+    for name in sorted(base):
+        sha.update(name.encode())
+        sha.update(np.ascontiguousarray(base[name], dtype=float).tobytes())
+    return sha.hexdigest()[:16]
+
+
+class MetricEngine:
+    def __init__(self, base, date_strs):
+        self.base = base
+        self.date_strs = date_strs
+        self.date_idx = {date_str: idx for idx, date_str in enumerate(date_strs)}
+        self.num_states = next(iter(base.values())).shape[1]
+        self.cache = {}
+        self.indexes = {}
+        self.param_cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.version = snapshot_version(base, date_strs)
+
+    def evaluate(self, expr):
+        if uses_param_ops(expr):
+            return self.param_cached(('evaluate', expr), lambda: self.compute(expr))
+        if expr not in self.cache:
+            self.cache[expr] = self.compute(expr)
+        return self.cache[expr]
+
+    def compute(self, expr):
+        op, *args = expr
+        return getattr(self, '_' + op)(*args)
+
+    def param_cached(self, key, compute):
+        with self.lock:
+            if key in self.param_cache:
+                self.param_cache.move_to_end(key)
+                return self.param_cache[key]
+        value = compute()
+        with self.lock:
+            self.param_cache[key] = value
+            while len(self.param_cache) > max_param_cached:
+                self.param_cache.popitem(last=False)
+        return value
+
+    def row(self, expr, date_str):
+        if date_str not in self.date_idx:
+            return np.full(self.num_states, np.nan)
+        return self.evaluate(expr)[self.date_idx[date_str]]
+
+    def rows(self, expr, date_strs):
+        idx = np.array([self.date_idx.get(date_str, -1) for date_str in date_strs], dtype=int)
+        res = self.evaluate(expr)[idx]
+        res[idx < 0] = np.nan
+        return res
+
+    def index(self, expr):
+        if uses_param_ops(expr):
+            return self.param_cached(('index', expr), lambda: build_rank_index(self.evaluate(expr)))
+        if expr not in self.indexes:
+            self.indexes[expr] = build_rank_index(self.evaluate(expr))
+        return self.indexes[expr]
+
+    def single_date_correlation(self, x_expr, x_date_str, y_expr, y_date_str, coefficient):
+        if x_date_str not in self.date_idx or y_date_str not in self.date_idx:
+            return np.nan, np.nan, np.nan, np.nan
+        return indexed_correlation(self.index(x_expr), self.date_idx[x_date_str], self.index(y_expr), self.date_idx[y_date_str], coefficient)
+
+    def _var(self, name):
+        return self.base[name]
+
+    def _since(self, expr, date_str):
+        return self.evaluate(expr) - self.row(expr, date_str)
+
+    def _diff(self, expr, days):
+        arr = self.evaluate(expr)
+        return arr - shift(arr, days)
+
+    def _growth(self, expr, days):
+        arr = self.evaluate(expr)
+        prev = shift(arr, days)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(prev > 0, arr / prev - 1, np.nan)
+
+    def _ratio(self, numerator, denominator):
+        num = self.evaluate(numerator)
+        den = self.evaluate(denominator)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(den != 0, num / den, np.nan)
+
+    def _per(self, expr, people):
+        return self.evaluate(expr) * people / 100000
+
+    def _scale(self, expr, factor):
+        return self.evaluate(expr) * factor
+
+    def _log(self, expr):
+        return np.log1p(np.maximum(self.evaluate(expr), 0))
+
+
+def build_base_arrays(date_strs, date_vars, state_vars, num_states):
+    # date_vars hold date -> per-state lists, state_vars hold one value per state that doesn't change over time
+    base = {name: date_array(date2values, date_strs, num_states) for name, date2values in date_vars.items()}
+    for name, values in state_vars.items():
+        base[name] = np.tile(np.asarray(values, dtype=float), (len(date_strs), 1))
+    return base
@@ -1,486 +1,39 @@
 import os
-import requests
-import json
 import matplotlib.pyplot as plt
-from tqdm import tqdm
 import numpy as np
-from scipy.stats.stats import pearsonr, spearmanr
-from collections import defaultdict
-from dotenv import load_dotenv
 import datetime
-import dateutil.parser
 import streamlit as st
 from matplotlib.offsetbox import (TextArea, DrawingArea, OffsetImage,
                                   AnnotationBbox)
 import textwrap
-import csv
-
-us_state_to_abbrev = {
-    "Alabama": "AL",
-    "Alaska": "AK",
-    "Arizona": "AZ",
-    "Arkansas": "AR",
-    "California": "CA",
-    "Colorado": "CO",
-    "Connecticut": "CT",
-    "Delaware": "DE",
-    "Florida": "FL",
-    "Georgia": "GA",
-    "Hawaii": "HI",
-    "Idaho": "ID",
-    "Illinois": "IL",
-    "Indiana": "IN",
-    "Iowa": "IA",
-    "Kansas": "KS",
-    "Kentucky": "KY",
-    "Louisiana": "LA",
-    "Maine": "ME",
-    "Maryland": "MD",
-    "Massachusetts": "MA",
-    "Michigan": "MI",
-    "Minnesota": "MN",
-    "Mississippi": "MS",
-    "Missouri": "MO",
-    "Montana": "MT",
-    "Nebraska": "NE",
-    "Nevada": "NV",
-    "New Hampshire": "NH",
-    "New Jersey": "NJ",
-    "New Mexico": "NM",
-    "New York": "NY",
-    "North Carolina": "NC",
-    "North Dakota": "ND",
-    "Ohio": "OH",
-    "Oklahoma": "OK",
-    "Oregon": "OR",
-    "Pennsylvania": "PA",
-    "Rhode Island": "RI",
-    "South Carolina": "SC",
-    "South Dakota": "SD",
-    "Tennessee": "TN",
-    "Texas": "TX",
-    "Utah": "UT",
-    "Vermont": "VT",
-    "Virginia": "VA",
-    "Washington": "WA",
-    "West Virginia": "WV",
-    "Wisconsin": "WI",
-    "Wyoming": "WY",
-}
-states = list(sorted(us_state_to_abbrev.values()))
-abbrev_to_us_state = {v: k for k, v in us_state_to_abbrev.items()}
-
-earlier_start_date = datetime.date(2020, 3, 1)
-start_date = datetime.date(2020, 4, 1)
-end_date = datetime.date.today() - datetime.timedelta(days=3)
-end_date_temp = datetime.date(2021, 9, 20)
-start_date_str = start_date.strftime('%Y-%m-%d')
-end_date_str = end_date.strftime('%Y-%m-%d')
+import matplotlib.dates as mdates
+import covid_data
+import api_server
+from covid_data import start_date, end_date, build_metrics
+from choices import X_choices, Y_choices
+from data_quality import repair_policies
+from correlations import rolling_correlation, correlation_series, coefficient_funcs, leave_one_out_series, indexed_coefficients
+from metrics import resolve
 
 
 st.title('COVID-19 Correlation Explorer')
 st.subheader('Find out what relationships exist between a U.S. state\'s number of COVID cases and several other factors, including vaccination rate, temperature, and mask mandates.')
 st.markdown('Look at examples below, or change the options in the left sidebar by clicking on the "**>**" arrow.')
 
-def get_row_value(daterow, row, population, daterow_idx, field):
-    today_cases = daterow[field]
-    if today_cases is None:
-        cases = 0
-    else:
-        today_cases = today_cases / population * 100000
-        lastweek_cases = row['actualsTimeseries'][daterow_idx-7][field]
-        if lastweek_cases is None:
-            lastweek_cases = 0
-        else:
-            lastweek_cases = lastweek_cases / population * 100000
-        cases = (today_cases - lastweek_cases) * 7  # TODO: multiply by 7 but then need to fix all the annotation coords
-    return cases, today_cases or 0
-
 @st.cache(suppress_st_warning=True, allow_output_mutation=True, show_spinner=False)
 def load_data():
+    return covid_data.load_data()
 
-    load_dotenv()
-
-    covidactnow_api_key = os.environ.get('COVID_ACTNOW_API_KEY')
-    # VisualCrossingWebServices_api_key = os.environ.get('VisualCrossingWebServices_API_KEY')
-    result = requests.get(f'https://api.covidactnow.org/v2/states.timeseries.json?apiKey={covidactnow_api_key}')
-    data = result.json()
-    a=0
-
-    with open('data/covid_data.json', 'w') as f:
-        json.dump(data, f, indent=2)
-
-    vaccines_today = []
-    temps = []
-    date2temps = defaultdict(list)
-    date2cases = defaultdict(list)
-    date2deaths = defaultdict(list)
-    date2totalcases = defaultdict(list)
-    date2totaldeaths = defaultdict(list)
-    date2vaccines = defaultdict(list)
-    dates = [start_date + datetime.timedelta(days=x) for x in range((end_date-start_date).days + 1)]
-    ealier_dates = [earlier_start_date + datetime.timedelta(days=x) for x in range((end_date-earlier_start_date).days + 1)]
-    for row in data:
-        state = row['state']
-        if state not in us_state_to_abbrev.values():
-            continue
-        population = row['population']
-        prev_vaccines = 0
-        vaccinationsCompleted = row['actuals']['vaccinationsCompleted']
-        print(state, vaccinationsCompleted)
-        maxvaccinationsCompleted = 0
-        for daterow_idx, daterow in enumerate(row['actualsTimeseries']):
-            if daterow_idx >= 7:
-                try:
-                    date = daterow['date']
-                    # if state == 'WY' and date == '2021-06-29':
-                    #     import pdb;pdb.set_trace()
-                    cases, totalcases = get_row_value(daterow, row, population, daterow_idx, 'cases')
-                    date2cases[date].append(cases)
-                    date2totalcases[date].append(totalcases)
-                    deaths, totaldeaths = get_row_value(daterow, row, population, daterow_idx, 'deaths')
-                    date2deaths[date].append(deaths)
-                    date2totaldeaths[date].append(totaldeaths)
-                    if 'vaccinationsCompleted' in daterow and daterow['vaccinationsCompleted'] is not None:
-                        vaccines = int(daterow['vaccinationsCompleted'])
-                        maxvaccinationsCompleted = max(maxvaccinationsCompleted, vaccines)
-                        vaccines = vaccines / population * 100000
-                    else:
-                        vaccines = prev_vaccines
-                    prev_vaccines = vaccines
-                    date2vaccines[date].append(vaccines)
-                except:
-                    print(daterow)
-                    print(date)
-                    print(state)
-                    raise
-        if vaccinationsCompleted is None:
-            vaccinationsCompleted = maxvaccinationsCompleted
-        vaccines_today.append(vaccinationsCompleted / population * 100000)
-
-
-    for state_idx, state in enumerate(tqdm(states)):
-        with open(os.path.join('data', 'temp', state + '.json')) as f:
-            temp_data = json.load(f)
-        past_7_days = []
-        for row in temp_data:
-            date = row['Date time'].replace('/', '-')
-            date = datetime.datetime.strptime(date, '%m-%d-%Y').date().strftime('%Y-%m-%d')
-            temp = float(row['Temperature'])
-            if len(past_7_days) >= 14:
-                past_7_days = past_7_days[1:]
-            past_7_days.append(temp)
-            ave_temp = np.mean(past_7_days)
-            date2temps[date].append(ave_temp)
-
-    with open('data/mask_mandate.tsv') as f:
-        lines = f.read().splitlines()
-    state2startmaskmandate = {}
-    state2endmaskmandate = {}
-    cur_state = None
-    for line in lines:
-        if '\t' in line:
-            items = line.strip().split('\t')
-            cur_state = items[0]
-            start = items[1]
-            end = items[2]
-            if start == 'N/A':
-                start = datetime.date(1970, 1, 1)
-            else:
-                start = dateutil.parser.parse(start).date()
-            if end == 'N/A':
-                end = datetime.date(1970, 1, 1)
-            elif end == 'Ongoing':
-                end = datetime.date.today()
-            else:
-                end = dateutil.parser.parse(end).date()
-            state2startmaskmandate[cur_state] = start
-            state2endmaskmandate[cur_state] = end
-    date2maskmandate = defaultdict(list)
-    for state, start in state2startmaskmandate.items():
-        end = state2endmaskmandate[state]
-        for date in ealier_dates:
-            if date >= start and date <= end:
-                date2maskmandate[date.strftime('%Y-%m-%d')].append(1)
-            else:
-                date2maskmandate[date.strftime('%Y-%m-%d')].append(0)
-
-    with open('data/political_party.tsv') as f:
-        lines = f.read().splitlines()
-    political_tuples = []
-    for line in lines:
-        items = line.strip().split('\t')
-        state = us_state_to_abbrev[items[0]]
-        dem_leaning = int(items[3])
-        political_tuples.append((state, dem_leaning))
-    politicals = []
-    for state, dem_leaning in sorted(political_tuples):
-        politicals.append(dem_leaning)
-
-    with open('data/age.tsv') as f:
-        lines = f.read().splitlines()
-    age_tuples = []
-    for line in lines:
-        items = line.strip().split('\t')
-        if items[1].strip() not in us_state_to_abbrev:
-            continue
-        state = us_state_to_abbrev[items[1].strip()]
-        age = float(items[2])
-        age_tuples.append((state, age))
-    ages = []
-    for state, age in sorted(age_tuples):
-        ages.append(age)
-
-    with open('data/population_density.tsv') as f:
-        lines = f.read().splitlines()
-    density_tuples = []
-    for line in lines:
-        items = line.strip().split('\t')
-        if items[1].strip() not in states:
-            continue
-        state = items[1].strip()
-        density = float(items[5].strip())
-        density_tuples.append((state, density))
-    densities = []
-    for state, density in sorted(density_tuples):
-        densities.append(density)
-
-    with open("data/uninsured.csv") as f:
-        reader = csv.reader(f, delimiter=",", quotechar='"')
-        next(reader, None)  # skip the headers
-        data = [row for row in reader]
-    uninsured_tuples = []
-    for row in data:
-        if row[0] not in us_state_to_abbrev:
-            continue
-        state = us_state_to_abbrev[row[0]]
-        uninsured = float(row[6]) * 100
-        uninsured_tuples.append((state, uninsured))
-    uninsureds = []
-    for state, uninsured in sorted(uninsured_tuples):
-        uninsureds.append(uninsured)
-
-    with open("data/household_income.json") as f:
-        data = json.load(f)
-    data = {item['State']: item['HouseholdIncome'] for item in data}
-    household_incomes = []
-    for state in states:
-        full_state_name = abbrev_to_us_state[state]
-        household_income = data[full_state_name]
-        household_incomes.append(household_income)
-
-    with open('data/healthcare_ranking.tsv') as f:
-        lines = f.read().splitlines()
-    healthcare_ranking_tuples = []
-    cur_rank = 1
-    for line in lines:
-        if line.strip() not in us_state_to_abbrev:
-            continue
-        state = us_state_to_abbrev[line.strip()]
-        healthcare_ranking = cur_rank
-        healthcare_ranking_tuples.append((state, healthcare_ranking))
-        cur_rank += 1
-    healthcare_rankings = []
-    for state, healthcare_ranking in sorted(healthcare_ranking_tuples):
-        healthcare_rankings.append(healthcare_ranking)
-
-
-    return dates, ealier_dates, date2temps, date2cases, date2deaths, date2totalcases, date2totaldeaths, date2maskmandate, date2vaccines, vaccines_today, politicals, ages, densities, uninsureds, household_incomes, healthcare_rankings, states
-
-    # temp_filename = 'temps_{}.pkl'.format(temp_date)
-    # if os.path.exists(temp_filename):
-    # with open(temp_filename, 'rb') as f:
-    #     temps = pickle.load(f)
-    # else:
-
-    # files = os.listdir(os.path.join('data', 'temp'))
-    # for file in files:
-    #     os.rename(os.path.join('data', 'temp', file), os.path.join('data', 'temp', file.split('_')[0] + '.json'))
-    #
-    # start_temp_date = '2020-03-01'
-    # end_temp_date = '2021-09-20'
-    # # states = ['FL']
-    # for state in tqdm(states):
-    #
-    #     # result = requests.get(f'https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/weatherdata/history?&aggregateHours=24&startDateTime={temp_date}T00:00:00&endDateTime={temp_date}T00:00:00&unitGroup=us&contentType=csv&dayStartTime=0:0:00&dayEndTime=0:0:00&location={state},US&key={VisualCrossingWebServices_api_key}')
-    #
-    #     result = requests.get(f'https://weather.visualcrossing.com/VisualCrossingWebServices/rest/services/weatherdata/history?&aggregateHours=24&startDateTime={start_temp_date}T00:00:00&endDateTime={end_temp_date}T00:00:00&unitGroup=us&contentType=csv&dayStartTime=0:0:00&dayEndTime=0:0:00&location={state},US&key={VisualCrossingWebServices_api_key}')
-    #     reader = csv.reader(result.text.strip().splitlines(), delimiter=",", quotechar='"')
-    #     header = next(reader, None)
-    #     rows = []
-    #     for line in reader:
-    #         row = {header[item_idx]: item for item_idx, item in enumerate(line)}
-    #         rows.append(row)
-    #     temp_filename = os.path.join('data', 'temp', '{}_{}_{}.json'.format(state, start_temp_date, end_temp_date))
-    #     with open(temp_filename, 'w') as f:
-    #         json.dump(rows, f, indent=2)
+@st.cache(suppress_st_warning=True, allow_output_mutation=True, show_spinner=False)
+def load_metrics(repair_policy):
+    return build_metrics(load_data(), repair_policy)
 
 with st.spinner(text="Fetching data. This will take only about 5 seconds..."):
     dates, ealier_dates, date2temps, date2cases, date2deaths, date2totalcases, date2totaldeaths, date2maskmandate, date2vaccines, vaccines_today, politicals, ages, densities, uninsureds, household_incomes, healthcare_rankings, states = load_data()
 
-def date2totalcasessincefunc(date, date2totalcases=None, sincedate=None):
-    res = []
-    for i in range(len(date2totalcases[date])):
-        val = date2totalcases[date][i] - date2totalcases[sincedate][i]
-        res.append(val)
-    return res
-def date2totaldeathssincefunc(date, date2totaldeaths=None, sincedate=None):
-    res = []
-    for i in range(len(date2totaldeaths[date])):
-        # print(sincedate)
-        # print(date)
-        # print(date2totaldeaths['2020-04-01'])
-        val = date2totaldeaths[date][i] - date2totaldeaths[sincedate][i]
-        res.append(val)
-    return res
-
-
-X_choices = {
-    'Temperature': {
-        'title': 'Temperature',
-        'x_label': 'State Temperature (°F)',
-        'date': 'delayed',
-        'var': date2temps,
-        'correlations': [],
-        'p_values': [],
-        'values': [],
-        'caption': 'Positive correlation shows that more cases happen in hot states. Negative correlation shows that more cases happen in cold states. There seems to be an interesting pattern that there is a positive correlation during the summer (hotter states have more cases), and negative during the winter (colder states have more cases). Temperature information was taken from Visual Crossing Weather API (https://www.visualcrossing.com/weather-api). I used a 14-day rolling average for daily temperature.',
-    },
-    'Vaccinations Completed': {
-        'title': 'Vaccinations Completed',
-        'x_label': 'State Vaccines Completed',
-        'date': 'delayed',
-        'var': date2vaccines,
-        'correlations': [],
-        'p_values': [],
-        'values': [],
-        'caption': 'Vaccinations are based on how many people were fully-vaccinated at that point in time. We would expect to see a negative correlation as more vaccines are administered, which is what we do see.',
-    },
-    'Vaccinations Completed (Numbers Reported Right Now)': {
-        'title': 'Vaccinations Completed (Numbers Reported Right Now)',
-        'x_label': 'State Vaccines Completed',
-        'date': 'none',
-        'var': vaccines_today,
-        'correlations': [],
-        'p_values': [],
-        'values': [],
-        'caption': 'Vaccinations are based on how many people are currently fully-vaccinated right now. This is to see if there are possible spurious correlations based on vaccinations. For example, you can see that right now, there is a strong negative correlation between vaccinations and cases, which is in support of vaccinating. However, the same correlation exists between TODAY\'S vaccination rate and SEPTEMBER OF LAST YEAR\'S cases, which is obviously a spurious correlation since today\'s vaccinations couldn\'t possible have had an effect on last year\'s case numbers. Vaccinations likely do have a large causal effect, but there is clearly another underlying cause leading to the correlation for last year.',
-    },
-    'Mask Mandate': {
-        'title': 'Mask Mandate',
-        'x_label': 'State Has Mask Mandate (1 if yes, 0 if no)',
-        'date': 'delayed',
-        'var': date2maskmandate,
-        'correlations': [],
-        'p_values': [],
-        'values': [],
-        'caption': 'Mask mandates do not seem to show a strong correlation with case numbers. Mask Mandate information was taken from Start Date and End Date found in this table: https://en.wikipedia.org/wiki/Face_masks_during_the_COVID-19_pandemic_in_the_United_States#Summary_of_orders_and_recommendations_issued_by_states. It is coarse and not very accurate.'
-    },
-    'Political Leaning': {
-        'title': 'State Political Leaning by Democratic Advantage',
-        'x_label': 'Democratic Advantage (%)',
-        'date': 'none',
-        'var': politicals,
-        'correlations': [],
-        'p_values': [],
-        'values': [],
-        'caption': 'Political Leaning information is based on how many percentage points that the Democratic party has over the Republican party, and was taken from a Gallup 2017 poll: https://news.gallup.com/poll/226643/2017-party-affiliation-state.aspx.'
-    },
-    'Median Age': {
-        'title': 'State Median Age',
-        'x_label': 'Median Age (years)',
-        'date': 'none',
-        'var': ages,
-        'correlations': [],
-        'p_values': [],
-        'values': [],
-        'caption': 'Age information taken from https://en.wikipedia.org/wiki/List_of_U.S._states_and_territories_by_median_age'
-    },
-    'Population Density': {
-        'title': 'State Population Density',
-        'x_label': 'Population Density (people/km^2)',
-        'date': 'none',
-        'var': densities,
-        'correlations': [],
-        'p_values': [],
-        'values': [],
-        'caption': 'The measure used here is "population-weighted population density," which takes into account urbanization. For example, New York state actually is not #1 in simple population density (since it is a fairly big state). However, most people living in New York are actually densely populated in NYC. Population-weighted population density takes this into account. Data and idea taken from https://wernerantweiler.ca/blog.php?item=2020-04-12&fbclid=IwAR2CHyOg5bFw3Rbu0c4-m8pc0D4cX2GVfCkzupUoCmUbL4NB1WQAaIZOx0s'
-    },
-    'Uninsured Rate': {
-        'title': 'State Uninsured Rate',
-        'x_label': 'Percent Uninsured (%)',
-        'date': 'none',
-        'var': uninsureds,
-        'correlations': [],
-        'p_values': [],
-        'values': [],
-        'caption': 'Percent uninsured information taken from https://www.kff.org/other/state-indicator/total-population/?currentTimeframe=0&sortModel=%7B%22colId%22:%22Location%22,%22sort%22:%22asc%22%7D'
-    },
-    'Median Household Income': {
-        'title': 'State Median Household Income',
-        'x_label': 'Median Household Income ($)',
-        'date': 'none',
-        'var': household_incomes,
-        'correlations': [],
-        'p_values': [],
-        'values': [],
-        'caption': 'Household income information taken from https://worldpopulationreview.com/state-rankings/median-household-income-by-state which took its data from the Census ACS survey https://www.census.gov/library/visualizations/interactive/2019-median-household-income.html'
-    },
-    'Healthcare Ranking': {
-        'title': 'State Healthcare Ranking',
-        'x_label': 'Healthcare Ranking',
-        'date': 'none',
-        'var': healthcare_rankings,
-        'correlations': [],
-        'p_values': [],
-        'values': [],
-        'caption': 'Healthcare rankings are {1-50} with lower numbers being better, e.g. Hawaii is #1 with the best healthcare quality and Alabama is #50 with the worst. Healthcare ranking information taken from https://www.usnews.com/news/best-states/rankings/health-care/healthcare-quality'
-    },
-}
-
-Y_choices = {
-    'Daily Cases': {
-        'title': 'Daily Cases',
-        'y_label': 'Daily Cases per 100k',
-        'var': date2cases,
-    },
-    'Daily Deaths': {
-        'title': 'Daily Deaths',
-        'y_label': 'Daily Deaths per 100k',
-        'var': date2deaths,
-    },
-    'Total Cases': {
-        'title': 'Total Cases',
-        'y_label': 'Total Cases per 100k',
-        'var': date2totalcases,
-    },
-    'Total Deaths': {
-        'title': 'Total Deaths',
-        'y_label': 'Total Deaths per 100k',
-        'var': date2totaldeaths,
-    },
-    'Total Vaccinations': {
-        'title': 'Total Vaccinations',
-        'y_label': 'Total Vaccinations per 100k',
-        'var': date2vaccines,
-    },
-    'Total Cases Since XX': {
-        'title': 'Total Cases Since XX',
-        'y_label': 'Total Cases per 100k',
-        'var': date2totalcasessincefunc,
-        'var_kwargs': {
-            'date2totalcases': date2totalcases,
-        }
-    },
-    'Total Deaths Since XX': {
-        'title': 'Total Deaths Since XX',
-        'y_label': 'Total Deaths per 100k',
-        'var': date2totaldeathssincefunc,
-        'var_kwargs': {
-            'date2totaldeaths': date2totaldeaths,
-        }
-    },
-}
+# Optionally serve the same correlation series as JSON for other dashboards, see api_server.py
+if os.environ.get('CORRELATIONS_API_PORT'):
+    api_server.start_in_background(int(os.environ['CORRELATIONS_API_PORT']), load_metrics('none')[0])
 
 example_options = {
     # 'Cold States': {
@@ -649,22 +202,35 @@ selected_example = example_options[selected_example_key]
 
 selected_X_keys = st.sidebar.multiselect('Select X data:', X_choices.keys(), default=selected_example['X'], key='x' + selected_example_key)
 selected_Y_key = st.sidebar.selectbox('Select Y data:', Y_choices.keys(), index=selected_example['Y'], key='y' + selected_example_key)
-mode_choices = ['Single date correlation', 'Correlation over time']
-mode = st.sidebar.selectbox('Correlation at single date or Correlation over time', mode_choices, index=selected_example['mode'], key='mode' + selected_example_key, help='See correlation at a specific date, or see how correlation has changed over time during the entire pandemic.')
+mode_choices = ['Single date correlation', 'Correlation over time', 'Rolling correlation within states']
+mode = st.sidebar.selectbox('Correlation at single date, over time, or within states', mode_choices, index=selected_example['mode'], key='mode' + selected_example_key, help='See correlation between states at a specific date, see how that correlation has changed over time during the entire pandemic, or see a heatmap of how each state\'s own numbers correlate over a rolling window of days.')
 delay = st.sidebar.slider('# Days to delay', 0, 30, selected_example['delay'], key='delay' + selected_example_key, help='For example, if you think there may be a 14-day delay between the start of a mask mandate and a corresponding reduction in COVID cases, then set this to 14')
 if mode == 'Single date correlation':
     selected_date = st.sidebar.slider('Date', start_date, end_date, value=selected_example['date'], step=datetime.timedelta(days=1), key='date' + selected_example_key)
     dates = [selected_date]
 else:
     selected_date = end_date
+if mode == 'Rolling correlation within states':
+    window = st.sidebar.slider('Rolling window (days)', 7, 120, 28, key='window' + selected_example_key, help='Number of days used for each state\'s correlation. The X data is shifted by "# Days to delay" before correlating. Only X data that changes over time (temperature, vaccinations, mask mandates) can be used here, and the Pearson correlation is always used.')
 if mode == 'Correlation over time':
     show_pvalues = st.sidebar.checkbox('Show P-Values', selected_example['p'], key='p' + selected_example_key, help='A low p-value (p < 0.05) indicates the correlation is not likely due to mere chance')
 else:
     show_pvalues = False
+if mode != 'Rolling correlation within states':
+    show_jackknife = st.sidebar.checkbox('Leave One State Out', False, key='jackknife' + selected_example_key, help='Recompute the correlation with each state left out, to see if a single state is driving it. Shows the range of those correlations over time and lists the states that change it the most.')
+else:
+    show_jackknife = False
 advanced_options = st.sidebar.expander('Advanced Options')
-coefficient_options = ['Spearman Correlation', 'Pearson Correlation']
-correlation_coefficient = advanced_options.selectbox('Correlation Coefficient', coefficient_options, coefficient_options.index(selected_example['coefficient']), key='coefficient' + selected_example_key, help='Pearson correlation is probably the most common measure for correlation, but it is susceptible to outliers. Spearman correlation is more robust to outliers.')
+coefficient_options = list(coefficient_funcs)
+if mode != 'Rolling correlation within states':
+    correlation_coefficient = advanced_options.selectbox('Correlation Coefficient', coefficient_options, coefficient_options.index(selected_example['coefficient']), key='coefficient' + selected_example_key, help='Pearson correlation is probably the most common measure for correlation, but it is susceptible to outliers. Spearman correlation and Kendall tau only look at the order of states, so they are more robust to outliers. Distance correlation and mutual information also pick up non-linear relationships, but they are always positive (0 means no relationship) so they don\'t show the direction of the relationship. Mutual information is shown on a 0-1 scale.')
+else:
+    correlation_coefficient = 'Pearson Correlation'
 sincedate = advanced_options.slider('Since Date', start_date, end_date, value=start_date, step=datetime.timedelta(days=1), key='sincedate' + selected_example_key, help='This only applies to "Total Cases Since XX" and "Total Deaths Since XX"')
+data_repair = advanced_options.selectbox('Data Repair', list(repair_policies), key='repair' + selected_example_key, help='The reported numbers have some artifacts, like negative case counts after a state corrects its totals, big one-day dumps of old cases, days where the total drops to 0, and vaccination numbers that stop updating. These are always listed in the Data Quality Report at the bottom. "Clip negatives" sets negative case/death counts to 0 and keeps totals from going down, "Interpolate flagged values" replaces all of them with a straight line between the surrounding good values (totals that are still low on the latest date are left as they are, but the case/death counts built from them are fixed).')
+
+with st.spinner(text="Checking data quality..."):
+    metrics, quality_report = load_metrics(repair_policies[data_repair])
 
 is_using_selected_example = True
 if selected_X_keys != selected_example['X']:
@@ -682,51 +248,42 @@ if show_pvalues != selected_example['p']:
 if correlation_coefficient != selected_example['coefficient']:
     is_using_selected_example = False
 
-X = [X_choices[k] for k in selected_X_keys]
+X = [dict(X_choices[k]) for k in selected_X_keys]
 y = Y_choices[selected_Y_key]
 
-us_cases = []
-all_corrs = []
-all_ps = []
-for date in dates:
-    date_str = date.strftime('%Y-%m-%d')
-    delayed_date_str = (date + datetime.timedelta(days=-delay)).strftime('%Y-%m-%d')
-    y_values = y['var']
-    if isinstance(y_values, dict):
-        y_val = y_values[date_str]
+date_strs = [date.strftime('%Y-%m-%d') for date in dates]
+delayed_date_strs = [(date + datetime.timedelta(days=-delay)).strftime('%Y-%m-%d') for date in dates]
+y_expr = resolve(y['expr'], {'sincedate': str(sincedate)})
+y_arr = metrics.rows(y_expr, date_strs)
+us_cases = np.mean(y_arr, axis=1)
+for x in X:
+    x['values'] = metrics.rows(x['expr'], delayed_date_strs if x['date'] == 'delayed' else date_strs)
+    if mode == 'Rolling correlation within states':
+        continue
+    # Dates without any X data (e.g. temperatures after they stop) are left out of the chart
+    has_data = ~np.isnan(x['values']).all(axis=1)
+    if mode == 'Single date correlation':
+        # Read the correlation and best-fit line from the per-date rank index built at load time,
+        # instead of re-ranking and refitting every time the date slider moves
+        x_date_str = delayed_date_strs[0] if x['date'] == 'delayed' else date_strs[0]
+        index_coefficient = correlation_coefficient if correlation_coefficient in indexed_coefficients else 'Pearson Correlation'
+        corr, p, slope, intercept = metrics.single_date_correlation(x['expr'], x_date_str, y_expr, date_strs[0], index_coefficient)
+        x['best_fit'] = (slope, intercept)
+    if mode == 'Single date correlation' and correlation_coefficient in indexed_coefficients:
+        correlations = np.array([corr])[has_data]
+        p_values = np.array([p])[has_data]
     else:
-        var_kwargs = y['var_kwargs']
-        var_kwargs['sincedate'] = str(sincedate)
-        y_val = y_values(date_str, **var_kwargs)
-    us_cases.append(np.mean(y_val))
-
-    for x in X:
-        if x['date'] == 'delayed':
-            x_values = x['var'][delayed_date_str]
-        elif x['date'] == 'current':
-            x_values = x['var'][date_str]
-        elif x['date'] == 'none':
-            x_values = x['var']
-        else:
-            x_values = None
-        is_incomplete = False
-        if len(x_values) == 0:
-            continue
-        # if len(x_values) != len(y_val):
-        #     print(x_values)
-        #     print(y_val)
-        #     print(delayed_date_str)
-        #     print(date2maskmandate[delayed_date_str])
-        if correlation_coefficient == 'Pearson Correlation':
-            corr, p = pearsonr(x_values, y_val)
-        else:
-            corr, p = spearmanr(x_values, y_val)
-        if np.isnan(corr):
-            corr = 0
-            p = 0
-        x['correlations'].append(corr)
-        x['p_values'].append(p)
-        x['values'].append(x_values)
+        correlations, p_values = correlation_series(x['values'][has_data], y_arr[has_data], correlation_coefficient)
+    if show_jackknife:
+        # Column i is how much the coefficient changes on each date when state i is left out
+        x['jackknife'] = leave_one_out_series(x['values'][has_data], y_arr[has_data], correlation_coefficient)
+        x['influences'] = x['jackknife'] - correlations[:, None]
+    is_nan = np.isnan(correlations)
+    correlations[is_nan] = 0
+    p_values[is_nan] = 0
+    x['dates'] = [date for date, is_valid in zip(dates, has_data) if is_valid]
+    x['correlations'] = correlations
+    x['p_values'] = p_values
 
 
 for x_idx, x in enumerate(X):
@@ -734,27 +291,49 @@ for x_idx, x in enumerate(X):
         fig, ax1 = plt.subplots()
         ax1.set_title(x['title'] + '-' + y['title'] + ' Correlation')
         props = dict(boxstyle='round', facecolor='wheat', alpha=0.5)
-        if len(x['values']) > 0:
+        if len(x['correlations']) > 0:
             values = x['values'][0]
+            y_val = y_arr[0]
             ax1.text(0.05, 0.95, "{}: {:.4f}\nP-Value: {:.15f}".format(correlation_coefficient, x['correlations'][0], x['p_values'][0]), verticalalignment='top', bbox=props, transform=ax1.transAxes)
             ax1.scatter(values, y_val, color='blue')
             ax1.set_xlabel(x['x_label'])
             ax1.set_ylabel(y['y_label'])
-            best_fit_x = list(np.unique(values))
-            if len(best_fit_x) > 1:
-                best_fit_y = np.poly1d(np.polyfit(values, y_val, 1))(np.unique(values))
-                ax1.plot(best_fit_x, best_fit_y, color='blue')
+            best_fit_x = np.unique(values[np.isfinite(values)])
+            slope, intercept = x['best_fit']
+            if len(best_fit_x) > 1 and not np.isnan(slope):
+                ax1.plot(best_fit_x, intercept + slope * best_fit_x, color='blue')
             for val, case, state in zip(values, y_val, states):
                 ax1.annotate(state, (val, case), color='blue')
+    elif mode == 'Rolling correlation within states':
+        if x['date'] != 'delayed':
+            st.write(f'{x["title"]} does not change over time, so it has no correlation within a state.')
+            continue
+        rolling_corrs = rolling_correlation(x['values'], y_arr, window)
+        fig, ax1 = plt.subplots(figsize=(8, 10))
+        ax1.set_title(x['title'] + '-' + y['title'] + f' {window}-Day Correlation Within Each State')
+        extent = [mdates.date2num(dates[0]), mdates.date2num(dates[-1]), len(states) - 0.5, -0.5]
+        im = ax1.imshow(rolling_corrs.T, aspect='auto', cmap='bwr', vmin=-1, vmax=1, extent=extent, interpolation='nearest')
+        ax1.xaxis_date()
+        ax1.set_yticks(range(len(states)))
+        ax1.set_yticklabels(states, fontsize=7)
+        plt.xticks(rotation=90)
+        fig.colorbar(im, ax=ax1, label='Pearson Correlation')
     else:
-        x_dates = dates[:len(x['correlations'])]
-        correlations = np.array(x['correlations'])
+        x_dates = x['dates']
+        correlations = x['correlations']
         fig, ax1 = plt.subplots()
         ax1.set_title(x['title'] + '-' + y['title'] + ' Correlation')
         ax1.set_ylabel('Correlation/P-Value')
-        ax1.plot(x_dates, correlations, label=correlation_coefficient + 's', color='black')
+        ax1.plot(x_dates, correlations, label=correlation_coefficient, color='black')
         if show_pvalues:
             line, = ax1.plot(x_dates, x['p_values'], label='P-Values', linestyle='dashed', color='gray')
+        if show_jackknife:
+            has_jackknife = ~np.isnan(x['jackknife']).all(axis=1)
+            band_low = np.full(len(x_dates), np.nan)
+            band_high = np.full(len(x_dates), np.nan)
+            band_low[has_jackknife] = np.nanmin(x['jackknife'][has_jackknife], axis=1)
+            band_high[has_jackknife] = np.nanmax(x['jackknife'][has_jackknife], axis=1)
+            ax1.fill_between(x_dates, band_low, band_high, color='gray', alpha=0.4, label='Leave-One-State-Out Range')
         plt.xticks(rotation=90)
         ax1.legend()
         ax1.fill_between(x_dates, correlations, 0, where=correlations > 0, interpolate=True, color='red', alpha=0.3)
@@ -772,6 +351,19 @@ for x_idx, x in enumerate(X):
                                 dict(facecolor=color,boxstyle='round',color='black',visible=is_bbox_visible,alpha=alpha))
             ax1.add_artist(ab)
     st.write(fig)
+    if show_jackknife and len(x['correlations']) > 0:
+        abs_influences = np.abs(x['influences'])
+        has_influence = ~np.isnan(abs_influences).all(axis=0)
+        mean_influences = np.full(len(states), np.nan)
+        mean_influences[has_influence] = np.nanmean(abs_influences[:, has_influence], axis=0)
+        influence_lines = []
+        for state_idx in np.argsort(-np.nan_to_num(mean_influences, nan=-1))[:5]:
+            if not has_influence[state_idx]:
+                break
+            biggest_idx = np.nanargmax(abs_influences[:, state_idx])
+            influence_lines.append('- **{}**: changes it by {:.4f} on average, and by {:+.4f} on {}'.format(states[state_idx], mean_influences[state_idx], x['influences'][biggest_idx, state_idx], x['dates'][biggest_idx]))
+        if len(influence_lines) > 0:
+            st.markdown(f'States that change the {correlation_coefficient} the most when left out:\n' + '\n'.join(influence_lines))
     st.caption(x['caption'])
 
 if mode != 'Single date correlation':
@@ -796,6 +388,27 @@ if mode != 'Single date correlation':
 st.caption('COVID cases, deaths, and vaccinations are taken from COVID Act Now API (https://covidactnow.org/). I used 7-day rolling average for daily cases and deaths, while vaccinations are the total number of people fully-vaccinated. Cases, deaths, and vaccinations are per 100k population in that state.')
 
 
+quality_expander = st.expander('Data Quality Report')
+quality_rows = []
+for name, issues in quality_report['issues'].items():
+    for issue, summary in issues.items():
+        if summary['count'] > 0:
+            quality_rows.append({
+                'Data': name,
+                'Issue': issue.replace('_', ' '),
+                'Values Flagged': summary['count'],
+                'Most Affected States': ', '.join(f'{state} ({count})' for state, count in list(summary['states'].items())[:5]),
+                'First Date': summary['first_date'],
+                'Last Date': summary['last_date'],
+            })
+if len(quality_rows) > 0:
+    quality_expander.table(quality_rows)
+else:
+    quality_expander.write('No reporting artifacts were found.')
+for name, misaligned_dates in quality_report['misaligned_dates'].items():
+    quality_expander.write(f'{name} is missing states on {len(misaligned_dates)} dates ({", ".join(misaligned_dates[:5])}{", ..." if len(misaligned_dates) > 5 else ""}), so those dates are left out.')
+quality_expander.caption(f'Repair: {data_repair}. The full report is written to data/quality_report_{repair_policies[data_repair]}.json.')
+
 st.markdown('<hr>', unsafe_allow_html=True)
 
 st.caption('Created by Logan Lebanoff. Contact me at loganlebanoff@gmail.com if you have any suggestions or other correlations you would like to see. Source code: https://github.com/loganlebanoff/covid_correlations.')